@@ -4,8 +4,15 @@ __author__ = """Dave St.Germain"""
 __email__ = 'dave@st.germa.in'
 __version__ = '0.19.0'
 
+import asyncio
+import sys
 import time
+from itertools import islice
+from json import loads
+from .event import Event
+from .key import PrivateKey
 from .relay import Manager, Relay
+from .util import from_nip19, NIP19_PREFIXES
 
 
 async def get_anything(anything:str, relays=None, verbose=False, stream=False, origin='aionostr', private_key=None):
@@ -16,8 +23,6 @@ async def get_anything(anything:str, relays=None, verbose=False, stream=False, o
     To stream events, set stream=True. This will return an asyncio.Queue to
     retrieve events from
     """
-    from .util import from_nip19, NIP19_PREFIXES
-
     query = None
     single_event = False
     if isinstance(anything, list):
@@ -28,7 +33,6 @@ async def get_anything(anything:str, relays=None, verbose=False, stream=False, o
     elif isinstance(anything, dict):
         query = anything
     elif anything.strip().startswith('{'):
-        from json import loads
         query = loads(anything)
     elif anything.startswith(NIP19_PREFIXES):
         anything = anything.replace('nostr:', '', 1)
@@ -58,7 +62,6 @@ async def get_anything(anything:str, relays=None, verbose=False, stream=False, o
         query = {"ids": [anything]}
         single_event = True
     if verbose:
-        import sys
         sys.stderr.write(f"Retrieving {query} from {relays}\n")
     if query:
         if not relays:
@@ -69,7 +72,6 @@ async def get_anything(anything:str, relays=None, verbose=False, stream=False, o
             async with man:
                 return [event async for event in man.get_events(query, single_event=single_event, only_stored=True)]
         else:
-            import asyncio
             queue = asyncio.Queue()
             async def _task():
                 async with man:
@@ -79,6 +81,23 @@ async def get_anything(anything:str, relays=None, verbose=False, stream=False, o
             return queue
 
 
+def _load_private_key(private_key: str) -> PrivateKey:
+    if not private_key:
+        raise Exception("Missing private key")
+    if private_key.startswith('nsec'):
+        return from_nip19(private_key)['object']
+    return PrivateKey(bytes.fromhex(private_key))
+
+
+def _sign_and_pack(prikey: PrivateKey, pubkey: str, content='', kind=1, tags=None, created_at=None) -> Event:
+    """
+    Create and sign an event, with an already loaded key
+    """
+    event = Event(pubkey=pubkey, content=content, created_at=created_at or int(time.time()), tags=tags or [], kind=kind)
+    prikey.sign_event(event)
+    return event
+
+
 async def add_event(relays, event:dict=None, private_key='', kind=1, pubkey='', content='', created_at=None, tags=None, direct_message='', verbose=False):
     """
     Add an event to the network, using the given relays
@@ -86,17 +105,9 @@ async def add_event(relays, event:dict=None, private_key='', kind=1, pubkey='',
     or will be created from the passed in parameters
     """
     if not event:
-        from .key import PrivateKey
-        from .event import Event
-        from .util import from_nip19
-        created_at = created_at or int(time.time())
         tags = tags or []
-        if not private_key:
-            raise Exception("Missing private key")
-
-        if private_key.startswith('nsec'):
-            private_key = from_nip19(private_key)['object'].hex()
-        prikey = PrivateKey(bytes.fromhex(private_key))
+        prikey = _load_private_key(private_key)
+        private_key = prikey.hex()
 
         if not pubkey:
             pubkey = prikey.public_key.hex()
@@ -105,8 +116,7 @@ async def add_event(relays, event:dict=None, private_key='', kind=1, pubkey='',
             tags.append(['p', dm_pubkey])
             kind = 4
             content = prikey.encrypt_message(content, dm_pubkey)
-        event = Event(pubkey=pubkey, content=content, created_at=created_at, tags=tags, kind=kind)
-        event.sign(prikey.hex())
+        event = _sign_and_pack(prikey, pubkey, content=content, kind=kind, tags=tags, created_at=created_at)
         event_id = event.id
     else:
         event_id = event['id']
@@ -115,7 +125,25 @@ async def add_event(relays, event:dict=None, private_key='', kind=1, pubkey='',
     return event_id
 
 
-async def add_events(relays, event_iterator):
+async def add_events(relays, event_iterator, batch_size=32, private_key=''):
+    """
+    Add many events to the network, sending them to the relays in batches
+
+    If private_key is given, unsigned dicts in event_iterator are taken as
+    parameters (content, kind, tags, created_at) for new events, all
+    signed with that key
+    """
+    if private_key:
+        prikey = _load_private_key(private_key)
+        pubkey = prikey.public_key.hex()
+        event_iterator = (
+            _sign_and_pack(prikey, pubkey, **event) if isinstance(event, dict) and 'sig' not in event else event
+            for event in event_iterator
+        )
+    event_iterator = iter(event_iterator)
     async with Manager(relays) as man:
-        for event in event_iterator:
-            await man.add_event(event)
\ No newline at end of file
+        while True:
+            batch = list(islice(event_iterator, batch_size))
+            if not batch:
+                break
+            await man.add_events(batch)
@@ -88,8 +88,38 @@ def bech32_decode(bech):
         return (None, None, None)
     return (hrp, data[:-6], spec)
 
+_BITS5 = [format(i, "05b") for i in range(32)]
+
+
+def _convertbits_8to5(data):
+    """convertbits(data, 8, 5), working on the whole input as one int."""
+    try:
+        data = bytes(data)
+    except ValueError:
+        return None
+    count = -(-len(data) * 8 // 5)
+    acc = int.from_bytes(data, "big") << (count * 5 - len(data) * 8)
+    return [(acc >> shift) & 31 for shift in range(count * 5 - 5, -1, -5)]
+
+
+def _convertbits_5to8(data):
+    """convertbits(data, 5, 8), going through a string of binary digits."""
+    if len(data) == 0:
+        return []
+    if min(data) < 0 or max(data) > 31:
+        return None
+    count = -(-len(data) * 5 // 8)
+    acc = int("".join([_BITS5[value] for value in data]), 2)
+    return list((acc << (count * 8 - len(data) * 5)).to_bytes(count, "big"))
+
+
 def convertbits(data, frombits, tobits, pad=True):
     """General power-of-2 base conversion."""
+    # fast paths for the conversions used by nip-19
+    if pad and frombits == 8 and tobits == 5:
+        return _convertbits_8to5(data)
+    if pad and frombits == 5 and tobits == 8:
+        return _convertbits_5to8(data)
     acc = 0
     bits = 0
     ret = []
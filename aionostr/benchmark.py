@@ -12,7 +12,9 @@ import asyncio
 import secrets
 import traceback
 
-from time import perf_counter, time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from time import perf_counter, perf_counter_ns, time
 from aionostr.event import Event
 from aionostr.key import PrivateKey
 from aionostr.relay import Relay, loads, dumps
@@ -20,36 +22,47 @@ from websockets import connect
 
 
 class catchtime:
+    """
+    Time a block. Loops should count in a local int and set `count` at the end
+    """
     __slots__ = ("start", "count", "duration")
 
     def __enter__(self):
-        self.start = perf_counter()
+        self.start = perf_counter_ns()
         self.count = 0
         return self
 
     def __exit__(self, type, value, traceback):
-        self.duration = perf_counter() - self.start
-
-    def __add__(self, value):
-        self.count += value
-        return self
+        self.duration = (perf_counter_ns() - self.start) / 1e9
 
     def throughput(self):
         return self.count / self.duration
 
 
-def make_events(num_events):
+def _sign_events(private_key, contents, pubkey, tags):
+    events = [
+        Event(kind=9999, content=content, pubkey=pubkey, tags=tags)
+        for content in contents
+    ]
+    sign = private_key.sign_event
+    for e in events:
+        sign(e)
+    return events
+
+
+def make_events(num_events, chunk_size=256):
     private_key = PrivateKey()
     pubkey = private_key.public_key.hex()
-    prikey = private_key.hex()
-    events = []
     expiration = str(int(time()) + 1200)
     tags = [["t", "benchmark"], ["expiration", expiration]]
-    for i in range(num_events):
-        e = Event(kind=9999, content=secrets.token_hex(6), pubkey=pubkey, tags=tags)
-        e.sign(prikey)
-        events.append(e)
-    return events
+    contents = [secrets.token_hex(6) for i in range(num_events)]
+    if num_events < 4 * chunk_size:
+        return _sign_events(private_key, contents, pubkey, tags)
+    # signing is cpu bound, so spread the chunks over all cores
+    chunks = [contents[i:i + chunk_size] for i in range(0, num_events, chunk_size)]
+    with ProcessPoolExecutor() as pool:
+        signed = pool.map(_sign_events, repeat(private_key), chunks, repeat(pubkey), repeat(tags))
+        return [e for chunk in signed for e in chunk]
 
 
 async def adds_per_second(url, num_events=100):
@@ -59,7 +72,7 @@ async def adds_per_second(url, num_events=100):
         with catchtime() as timer:
             for e in events:
                 await relay.add_event(e, check_response=True)
-                timer += 1
+            timer.count = len(events)
     print(f"\tAdd: took {timer.duration:.2f} seconds. {timer.throughput():.1f}/sec")
     return timer.throughput()
 
@@ -69,7 +82,7 @@ async def events_per_second(url, kind=9999, limit=500, duration=20, id=None, **k
     query_str = dumps(["REQ", "bench", query])
     query_close = dumps(["CLOSE", "bench"])
     total_bytes = 0
-    async with connect(url) as ws:
+    async with connect(url, compression=None) as ws:
         print(f"connected {id}")
         timer, total_bytes = await asyncio.wait_for(_make_requests(ws, query, limit, duration), timeout=duration+1)
 
@@ -87,6 +100,7 @@ async def _make_requests(ws, query, limit, duration):
     query_close = dumps(["CLOSE", "bench"])
     send = ws.send
     recv = ws.recv
+    num_reqs = 0
     with catchtime() as timer:
         while perf_counter() < stoptime:
             try:
@@ -95,12 +109,14 @@ async def _make_requests(ws, query, limit, duration):
                 while True:
                     event = await recv()
                     total_bytes += len(event)
-                    if not event.startswith('["EVENT"'):
+                    # ["EVENT" is the only frame type with V as its second letter
+                    # (EOSE, NOTICE, CLOSED, OK, AUTH)
+                    if event[3] != 'V':
                         if count != limit:
                             raise Exception(f"Did not receive full req: {count} {limit}")
                         break
                     count += 1
-                timer += 1
+                num_reqs += 1
                 await send(query_close)
             except asyncio.exceptions.CancelledError:
                 break
@@ -110,11 +126,12 @@ async def _make_requests(ws, query, limit, duration):
             except Exception as e:
                 traceback.print_exc()
                 break
+        timer.count = num_reqs
     return timer, total_bytes
 
 async def req_per_second(url, kind=9999, limit=50, duration=20, id=0):
     query = {"kinds": [kind], "limit": limit}
-    async with connect(url) as ws:
+    async with connect(url, compression=None) as ws:
         print(f"connected {id}")
         timer, total_bytes = await asyncio.wait_for(_make_requests(ws, query, limit, duration), timeout=duration+1)
 
@@ -125,20 +142,22 @@ async def req_per_second(url, kind=9999, limit=50, duration=20, id=0):
     return timer.count, total_bytes
 
 async def runner(concurrency, func, *args, **kwargs):
-    tasks = []
     start = perf_counter()
-    for i in range(concurrency):
-        kwargs["id"] = i
-        tasks.append(asyncio.create_task(func(*args, **kwargs)))
-
-    results = await asyncio.wait(tasks)
+    if hasattr(asyncio, "TaskGroup"):
+        # a failing task cancels its siblings instead of leaving them running
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(func(*args, id=i, **kwargs))
+                for i in range(concurrency)
+            ]
+        results = [task.result() for task in tasks]
+    else:
+        results = await asyncio.gather(
+            *(func(*args, id=i, **kwargs) for i in range(concurrency))
+        )
     duration = perf_counter() - start
-    total_count = 0
-    total_bytes = 0
-    for r in results[0]:
-        count, received = r.result()
-        total_count += count
-        total_bytes += received
+    total_count = sum(count for count, _ in results)
+    total_bytes = sum(received for _, received in results)
     total_bps = (total_bytes / duration) / (1024 * 1024)
     total_throughput = total_count / duration
     print(f"Total throughput: {total_throughput:.1f}/sec")
@@ -11,10 +11,11 @@ from . import get_anything, add_event
 
 try:
     import uvloop
-
-    uvloop.install()
 except ImportError:
-    pass
+    uvloop = None
+
+if os.getenv('AIONOSTR_UVLOOP', '1') == '0':
+    uvloop = None
 
 
 DEFAULT_RELAYS = os.getenv('NOSTR_RELAYS', 'wss://nos.lol,wss://nostr.mom').split(',')
@@ -23,6 +24,13 @@ DEFAULT_RELAYS = os.getenv('NOSTR_RELAYS', 'wss://nos.lol,wss://nostr.mom').spli
 def async_cmd(func):
   @wraps(func)
   def wrapper(*args, **kwargs):
+    if uvloop is None:
+      return asyncio.run(func(*args, **kwargs))
+    if hasattr(asyncio, 'Runner'):
+      # python 3.11+. uvloop.install() is deprecated as of 3.12
+      with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+        return runner.run(func(*args, **kwargs))
+    uvloop.install()
     return asyncio.run(func(*args, **kwargs))
   return wrapper
 
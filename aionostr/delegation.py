@@ -3,6 +3,8 @@ forked from https://github.com/jeffthibault/python-nostr.git
 """
 import time
 from dataclasses import dataclass
+from functools import cached_property
+from hashlib import sha256
 
 
 @dataclass
@@ -13,8 +15,9 @@ class Delegation:
     duration_secs: int = 30*24*60  # default to 30 days
     signature: str = None  # set in PrivateKey.sign_delegation
 
-    @property
+    @cached_property
     def expires(self) -> int:
+        # fixed on first use, so the signed token and the tag's conditions agree
         return int(time.time()) + self.duration_secs
     
     @property
@@ -25,6 +28,11 @@ class Delegation:
     def delegation_token(self) -> str:
         return f"nostr:delegation:{self.delegatee_pubkey}:{self.conditions}"
 
+    @property
+    def token_digest(self) -> bytes:
+        """ sha256 of the delegation token, which is what gets signed """
+        return sha256(self.delegation_token.encode()).digest()
+
     def get_tag(self) -> list[str]:
         """ Called by Event """
         return [
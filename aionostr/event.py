@@ -8,15 +8,31 @@ from coincurve import PrivateKey, PublicKeyXOnly as PublicKey
 from hashlib import sha256
 
 try:
-    import rapidjson
+    import orjson
+
+    loads = orjson.loads
+    # orjson output is already compact and unescaped, as nip-01 requires
+    dump_bytes = orjson.dumps
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
 
-    loads = rapidjson.loads
-    dumps = functools.partial(rapidjson.dumps, ensure_ascii=False)
 except ImportError:
-    import json
+    try:
+        import rapidjson
+
+        loads = rapidjson.loads
+        dumps = functools.partial(rapidjson.dumps, ensure_ascii=False)
+    except ImportError:
+        import json
+
+        loads = json.loads
+        dumps = functools.partial(
+            json.dumps, separators=(",", ":"), ensure_ascii=False
+        )
 
-    loads = json.loads
-    dumps = functools.partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+    def dump_bytes(obj):
+        return dumps(obj).encode()
 
 
 class EventKind(IntEnum):
@@ -64,6 +80,13 @@ class Event:
             )
         self.id = id
 
+    @classmethod
+    def from_json(cls, data) -> "Event":
+        """
+        Create an Event from its json serialization (str or bytes)
+        """
+        return cls(**loads(data))
+
     @property
     def id_bytes(self):
         return bytes.fromhex(self.id)
@@ -88,9 +111,7 @@ class Event:
         tags: "list[list[str]]",
         content: str,
     ) -> bytes:
-        data = [0, public_key, created_at, kind, tags, content]
-        data_str = dumps(data)
-        return data_str.encode()
+        return dump_bytes([0, public_key, created_at, kind, tags, content])
 
     @staticmethod
     def compute_id(
@@ -106,7 +127,7 @@ class Event:
 
     def sign(self, private_key_hex: str) -> None:
         sk = PrivateKey(bytes.fromhex(private_key_hex))
-        sig = sk.sign_schnorr(bytes.fromhex(self.id), None)
+        sig = sk.sign_schnorr(self.id_bytes, None)
         self.sig = sig.hex()
 
     def verify(self) -> bool:
@@ -2,11 +2,10 @@
 forked from https://github.com/jeffthibault/python-nostr.git
 """
 import secrets
-import base64
+import binascii
 import coincurve
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives import padding
-from hashlib import sha256
 
 from .delegation import Delegation
 from .event import Event
@@ -44,8 +43,15 @@ class PrivateKey:
         else:
             self.raw_secret = secrets.token_bytes(32)
 
-        sk = coincurve.PrivateKey(self.raw_secret)
-        self.public_key = PublicKey(sk.public_key.format()[1:])
+        # kept around, so signing and ecdh don't have to rebuild the key
+        self._sk = coincurve.PrivateKey(self.raw_secret)
+        # peer public key hex -> ecdh secret, for NIP-04 conversations
+        self._shared_secrets = {}
+        self.public_key = PublicKey(self._sk.public_key.format()[1:])
+
+    def __reduce__(self):
+        # the coincurve key can't be pickled or copied. rebuild it from the secret
+        return (self.__class__, (self.raw_secret,))
 
     @classmethod
     def from_nsec(cls, nsec: str):
@@ -62,17 +68,26 @@ class PrivateKey:
         return self.raw_secret.hex()
 
     def tweak_add(self, scalar: bytes) -> bytes:
-        sk = coincurve.PrivateKey(self.raw_secret)
-        return sk.add(scalar)
+        return self._sk.add(scalar)
 
     def compute_shared_secret(self, public_key_hex: str) -> bytes:
-        return coincurve.PrivateKey(self.raw_secret).ecdh(
-            bytes.fromhex("02" + public_key_hex)
-        )
+        secret = self._shared_secrets.get(public_key_hex)
+        if secret is None:
+            if len(self._shared_secrets) >= 1024:
+                self._shared_secrets.clear()
+            # NIP-04 uses the raw x coordinate of the shared point. coincurve's
+            # ecdh() would hash it, which other clients can't decrypt
+            point = coincurve.PublicKey(bytes.fromhex("02" + public_key_hex))
+            secret = self._shared_secrets[public_key_hex] = point.multiply(
+                self.raw_secret
+            ).format()[1:]
+        return secret
 
     def encrypt_message(self, message: str, public_key_hex: str) -> str:
-        padder = padding.PKCS7(128).padder()
-        padded_data = padder.update(message.encode()) + padder.finalize()
+        # PKCS7 pad to the AES block size
+        data = message.encode()
+        pad = 16 - len(data) % 16
+        padded_data = data + bytes((pad,)) * pad
 
         iv = secrets.token_bytes(16)
         cipher = Cipher(
@@ -82,56 +97,89 @@ class PrivateKey:
         encryptor = cipher.encryptor()
         encrypted_message = encryptor.update(padded_data) + encryptor.finalize()
 
-        return f"{base64.b64encode(encrypted_message).decode()}?iv={base64.b64encode(iv).decode()}"
+        return f"{binascii.b2a_base64(encrypted_message, newline=False).decode()}?iv={binascii.b2a_base64(iv, newline=False).decode()}"
 
     def decrypt_message(self, encoded_message: str, public_key_hex: str) -> str:
         encoded_data = encoded_message.split("?iv=")
         encoded_content, encoded_iv = encoded_data[0], encoded_data[1]
 
-        iv = base64.b64decode(encoded_iv)
+        iv = binascii.a2b_base64(encoded_iv)
         cipher = Cipher(
             algorithms.AES(self.compute_shared_secret(public_key_hex)), modes.CBC(iv)
         )
-        encrypted_content = base64.b64decode(encoded_content)
+        encrypted_content = binascii.a2b_base64(encoded_content)
 
         decryptor = cipher.decryptor()
         decrypted_message = decryptor.update(encrypted_content) + decryptor.finalize()
 
-        unpadder = padding.PKCS7(128).unpadder()
-        unpadded_data = unpadder.update(decrypted_message) + unpadder.finalize()
+        pad = decrypted_message[-1] if decrypted_message else 0
+        if not 0 < pad <= 16 or decrypted_message[-pad:] != bytes((pad,)) * pad:
+            raise ValueError("Invalid padding bytes.")
 
-        return unpadded_data.decode()
+        return decrypted_message[:-pad].decode()
 
     def sign_message_hash(self, hash: bytes) -> str:
-        sk = coincurve.PrivateKey(self.raw_secret)
-        sig = sk.sign_schnorr(hash, None)
-        return sig.hex()
+        return self._sk.sign_schnorr(hash, None).hex()
 
     def sign_event(self, event: Event) -> None:
-        event.sig = self.sign_message_hash(bytes.fromhex(event.id))
+        event.sig = self.sign_message_hash(event.id_bytes)
 
     def sign_delegation(self, delegation: Delegation) -> None:
-        delegation.signature = self.sign_message_hash(
-            sha256(delegation.delegation_token.encode()).digest()
-        )
+        delegation.signature = self.sign_message_hash(delegation.token_digest)
 
     def __eq__(self, other):
         return self.raw_secret == other.raw_secret
 
 
-def mine_vanity_key(prefix: str = None, suffix: str = None) -> PrivateKey:
-    if prefix is None and suffix is None:
-        raise ValueError("Expected at least one of 'prefix' or 'suffix' arguments")
-
-    while True:
-        sk = PrivateKey()
-        if (
-            prefix is not None
-            and not sk.public_key.bech32()[5 : 5 + len(prefix)] == prefix
-        ):
+def _mine_vanity_batch(prefix: str, suffix: str, tries: int) -> bytes:
+    """
+    Try `tries` random keys, returning the raw secret of the first match, or None
+    """
+    if prefix:
+        # the npub prefix is just the top 5 * len(prefix) bits of the public key,
+        # so compare those directly instead of bech32 encoding every candidate
+        shift = 256 - 5 * len(prefix)
+        target = 0
+        for char in prefix:
+            target = (target << 5) | bech32.CHARSET.index(char)
+    for i in range(tries):
+        raw_secret = secrets.token_bytes(32)
+        raw_public = coincurve.PrivateKey(raw_secret).public_key.format()[1:]
+        if prefix and int.from_bytes(raw_public, "big") >> shift != target:
             continue
-        if suffix is not None and not sk.public_key.bech32()[-len(suffix) :] == suffix:
+        if suffix and not PublicKey(raw_public).bech32().endswith(suffix):
             continue
-        break
+        return raw_secret
+    return None
+
 
-    return sk
+def mine_vanity_key(prefix: str = None, suffix: str = None, workers: int = 1, batch_size: int = 10000) -> PrivateKey:
+    """
+    Generate keys until the npub starts with prefix and/or ends with suffix.
+    With workers > 1, the search runs in that many processes
+    """
+    if prefix is None and suffix is None:
+        raise ValueError("Expected at least one of 'prefix' or 'suffix' arguments")
+    for part in (prefix, suffix):
+        if part and not all(char in bech32.CHARSET for char in part):
+            raise ValueError(f"{part!r} can't appear in an npub")
+    if prefix and len(prefix) > 51:
+        raise ValueError("prefix is too long")
+
+    if workers <= 1:
+        while True:
+            raw_secret = _mine_vanity_batch(prefix, suffix, batch_size)
+            if raw_secret is not None:
+                return PrivateKey(raw_secret)
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = {pool.submit(_mine_vanity_batch, prefix, suffix, batch_size) for i in range(workers)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                raw_secret = future.result()
+                if raw_secret is not None:
+                    for other in pending:
+                        other.cancel()
+                    return PrivateKey(raw_secret)
+                pending.add(pool.submit(_mine_vanity_batch, prefix, suffix, batch_size))
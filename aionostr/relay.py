@@ -1,17 +1,30 @@
 import asyncio
+import functools
 import secrets
 import time
 import sys
 import logging
 from contextlib import asynccontextmanager
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 from websockets import connect, exceptions
 from .event import Event
+from .key import PrivateKey
+from .util import from_nip19
 
 try:
-    from rapidjson import dumps, loads
+    import orjson
+
+    loads = orjson.loads
+
+    def dumps(obj):
+        # orjson returns bytes, which websockets would send as a binary frame.
+        # relays expect text frames, so hand back a str
+        return orjson.dumps(obj).decode()
 except ImportError:
-    from json import dumps, loads
+    try:
+        from rapidjson import dumps, loads
+    except ImportError:
+        from json import dumps, loads
 
 if hasattr(asyncio, 'timeout'):
     timeout = asyncio.timeout
@@ -23,40 +36,146 @@ else:
         yield
 
 
-Subscription = namedtuple('Subscription', ['filters','queue'])
+Subscription = namedtuple('Subscription', ['filters','queue', 'seen', 'req', 'raw', 'owns_queue'], defaults=[None, None, False, False])
+
+
+class RecentIds:
+    """
+    Bounded memory of recently seen event ids.
+    Once `size` ids have been added, they become the old generation and
+    a fresh set is started, so between size and 2 * size ids are remembered
+    """
+    __slots__ = ('size', 'current', 'old')
+
+    def __init__(self, size: int=65536):
+        self.size = size
+        self.current = set()
+        self.old = set()
+
+    def __contains__(self, eid) -> bool:
+        return eid in self.current or eid in self.old
+
+    def add(self, eid) -> bool:
+        """
+        Remember eid, returning False if it had already been seen
+        """
+        if eid in self.current or eid in self.old:
+            return False
+        self.current.add(eid)
+        if len(self.current) >= self.size:
+            self.old = self.current
+            self.current = set()
+        return True
+
+
+def _drain(queue):
+    # wakes a receive loop that was blocked putting to the (full) queue
+    while not queue.empty():
+        queue.get_nowait()
+
+
+def _quote(sub_id: str) -> str:
+    # subscription ids are normally short hex tokens, which need no escaping
+    if sub_id.isalnum():
+        return f'"{sub_id}"'
+    return dumps(sub_id)
+
+
+def req_frame(sub_id: str, filters) -> str:
+    """
+    Build a ["REQ", sub_id, *filters] frame, only serializing the filters
+    """
+    return f'["REQ",{_quote(sub_id)}' + ''.join(',' + dumps(f) for f in filters) + ']'
+
+
+def close_frame(sub_id: str) -> str:
+    return f'["CLOSE",{_quote(sub_id)}]'
+
+
+def split_event(frame: bytes):
+    """
+    Pull the subscription id and event id out of an ["EVENT", sub_id, {...}] frame,
+    leaving the event itself as unparsed json.
+    Frames that aren't in the usual compact form are parsed in full, returning the event dict
+    """
+    end = frame.find(b'"', 10)
+    if (frame.startswith(b'["EVENT","') and end != -1 and frame.startswith(b',{', end + 1)
+            and frame.endswith(b'}]') and b'\\' not in frame[10:end]):
+        # quotes inside strings are escaped, so this can only match the "id" key
+        start = frame.find(b'"id":"', end)
+        if start != -1 and frame[start + 70:start + 71] == b'"':
+            return frame[10:end].decode(), frame[start + 6:start + 70], frame[end + 2:-1]
+    message = loads(frame)
+    return message[1], message[2]['id'].encode(), message[2]
 
 
 class Relay:
     """
     Interact with a relay
+
+    queue_size bounds each subscription's queue (0, the default, is unbounded).
+    A full queue makes the receive loop wait, which stops the whole connection:
+    other subscriptions, OK, NOTICE and AUTH replies included. So a consumer that
+    waits on the same relay while its queue is full (e.g. add_event with
+    check_response=True while iterating a subscription) will deadlock
     """
-    def __init__(self, url, verbose=False, origin:str = '', private_key:str='', connect_timeout: float=2.0, log=None):
+    __slots__ = (
+        'log', 'url', 'ws', 'recv', 'receive_task', 'queue_size', 'subscriptions',
+        'event_adds', 'auth_task', 'auth_waiters', 'notices', '_private_key',
+        '_auth_key', 'origin', 'connected', 'connect_timeout', 'max_size', 'compression',
+    )
+
+    def __init__(self, url, verbose=False, origin:str = '', private_key:str='', connect_timeout: float=2.0, log=None, queue_size: int=0, max_size: int=2**22, compression: str=None):
         self.log = log or logging.getLogger(__name__)
         self.url = url
         self.ws = None
+        self.recv = None
         self.receive_task = None
-        self.subscriptions = defaultdict(lambda: Subscription(filters=[], queue=asyncio.Queue()))
+        # if bounded, full queues push back on the receive loop (and the socket) when consumers fall behind
+        self.queue_size = queue_size
+        self.subscriptions = {}
         self.event_adds = asyncio.Queue()
+        self.auth_task = None
+        # AUTH event id -> future for the relay's OK
+        self.auth_waiters = {}
         self.notices = asyncio.Queue()
+        self._auth_key = None
         self.private_key = private_key
         self.origin = origin or url
         self.connected = False
         self.connect_timeout = connect_timeout
+        # largest message accepted from the relay. large EOSE replays and
+        # contact lists can go past the websockets default of 1MiB
+        self.max_size = max_size
+        # nostr messages are small, so permessage-deflate costs more than it saves.
+        # pass compression='deflate' to negotiate it anyway
+        self.compression = compression
+
+    @property
+    def private_key(self):
+        return self._private_key
+
+    @private_key.setter
+    def private_key(self, pk):
+        self._private_key = pk
+        # decoded on the first AUTH, then reused for every challenge
+        self._auth_key = None
 
     async def connect(self, retries=5):
         for i in range(retries):
             try:
                 async with timeout(self.connect_timeout):
-                    self.ws = await connect(self.url, origin=self.origin)
+                    self.ws = await connect(self.url, origin=self.origin, max_size=self.max_size, compression=self.compression)
             except:
                 await asyncio.sleep(0.2 * i)
             else:
                 break
         else:
             raise Exception(f"Cannot connect to {self.url}")
+        # hand back the raw frame, skipping the utf-8 decode
+        self.recv = functools.partial(self.ws.recv, decode=False)
         if self.receive_task is None:
             self.receive_task = asyncio.create_task(self._receive_messages())
-        await asyncio.sleep(0.01)
         self.connected = True
         self.log.info("Connected to %s", self.url)
 
@@ -64,50 +183,139 @@ class Relay:
         await self.connect(20)
         for sub_id, sub in self.subscriptions.items():
             self.log.debug("resubscribing to %s", sub.filters)
-            await self.send(["REQ", sub_id, *sub.filters])
+            await self.send_raw(sub.req)
 
     async def close(self):
         if self.receive_task:
             self.receive_task.cancel()
+        if self.auth_task:
+            self.auth_task.cancel()
         if self.ws:
             await self.ws.close()
         self.connected = False
 
     async def _receive_messages(self):
+        received = 0
         while True:
             try:
-                async with timeout(30.0):
-                    message = await self.ws.recv()
-
-                self.log.debug(message)
-                message = loads(message)
-                if message[0] == 'EVENT':
-                    await self.subscriptions[message[1]].queue.put(Event(**message[2]))
-                elif message[0] == 'EOSE':
-                    await self.subscriptions[message[1]].queue.put(None)
-                elif message[0] == 'OK':
-                    await self.event_adds.put(message)
-                elif message[0] == 'NOTICE':
-                    await self.notices.put(message[1])
-                elif message[0] == 'AUTH':
-                    await self.authenticate(message[1])
+                message = await self.recv()
+                received += 1
+                if not received % 64:
+                    # recv() doesn't suspend while frames are buffered, and neither does
+                    # put_nowait(). give the consumers a turn now and then
+                    await asyncio.sleep(0)
+
+                if self.log.isEnabledFor(logging.DEBUG):
+                    self.log.debug(message.decode('utf8', 'replace'))
+                if message.startswith(b'["EVENT",'):
+                    # Event parsing and construction is left to the consumer, to keep this loop
+                    # draining the socket
+                    sub_id, event_id, event = split_event(message)
+                else:
+                    message = loads(message)
+                    if message[0] == 'EVENT':
+                        # valid, but not in the compact form split_event looks for
+                        sub_id, event_id, event = message[1], message[2]['id'].encode(), message[2]
+                    else:
+                        await self._handle_message(message)
+                        continue
+                sub = self.subscriptions.get(sub_id)
+                if sub is None:
+                    # late message for a closed subscription
+                    self.log.debug("dropping EVENT for unknown subscription %s", sub_id)
+                    continue
+                # duplicates (already delivered by another relay) are dropped here, keyed on
+                # the first 8 bytes of the id as an int: cheap to hash and store, and
+                # collisions within one subscription are not a concern.
+                # an id is only marked as seen once its Event has been built, so a copy
+                # that won't parse can't hide a good copy from another relay
+                key = int(event_id[:16], 16)
+                seen = sub.seen
+                if seen is not None and key in seen:
+                    continue
+                if sub.raw:
+                    if isinstance(event, dict):
+                        # rare: the frame needed a full parse. raw subscribers always get json
+                        event = dumps(event).encode()
                 else:
-                    sys.stderr.write(message)
+                    event = Event(**event) if isinstance(event, dict) else Event.from_json(event)
+                    if seen is not None and not seen.add(key):
+                        continue
+                try:
+                    sub.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # the consumer is behind. waiting here stops reading from the socket
+                    await sub.queue.put(event)
             except asyncio.CancelledError:
                 return
             except exceptions.ConnectionClosedError:
                 await self.reconnect()
-            except asyncio.TimeoutError:
-                continue
             except:
                 import traceback; traceback.print_exc()
 
+    async def _handle_message(self, message):
+        """
+        Handle a parsed message other than EVENT
+        """
+        if message[0] == 'EOSE':
+            sub = self.subscriptions.get(message[1])
+            if sub is None:
+                self.log.debug("dropping EOSE for unknown subscription %s", message[1])
+            else:
+                try:
+                    sub.queue.put_nowait(None)
+                except asyncio.QueueFull:
+                    await sub.queue.put(None)
+        elif message[0] == 'OK':
+            waiter = self.auth_waiters.pop(message[1], None)
+            if waiter is None:
+                self.event_adds.put_nowait(message)
+            elif not waiter.done():
+                waiter.set_result(message)
+        elif message[0] == 'NOTICE':
+            self.notices.put_nowait(message[1])
+        elif message[0] == 'AUTH':
+            # the OK for our AUTH arrives through this loop, so don't wait for it here.
+            # a new challenge replaces any AUTH still in progress
+            if self.auth_task is not None:
+                self.auth_task.cancel()
+            self.auth_task = asyncio.create_task(self.authenticate(message[1]))
+            self.auth_task.add_done_callback(self._auth_done)
+        else:
+            sys.stderr.write(message)
+
+    def _auth_done(self, task):
+        # nobody awaits the auth task, so report its failures here
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error("AUTH to %s failed", self.url, exc_info=task.exception())
+
     async def send(self, message):
+        """
+        Send a message, which can be already serialized
+        """
+        if not isinstance(message, str):
+            message = dumps(message)
+        await self.send_raw(message)
+
+    async def send_raw(self, frame: str):
+        """
+        Send an already serialized message
+        """
         try:
-            await self.ws.send(dumps(message))
+            await self.ws.send(frame)
         except exceptions.ConnectionClosedError:
             await self.reconnect()
-            await self.ws.send(dumps(message))
+            await self.ws.send(frame)
+
+    async def send_many(self, messages):
+        """
+        Send a batch of messages back to back.
+        Each one is still its own websocket message, since relays expect
+        exactly one nostr message per frame
+        """
+        frames = [dumps(message) for message in messages]
+        for frame in frames:
+            await self.send_raw(frame)
 
     async def add_event(self, event, check_response=False):
         if isinstance(event, Event):
@@ -117,26 +325,54 @@ class Relay:
             response = await self.event_adds.get()
             return response[1]
 
-    async def subscribe(self, sub_id: str, *filters, queue=None):
-        self.subscriptions[sub_id] = Subscription(filters=filters, queue=queue or asyncio.Queue())
-        await self.send(["REQ", sub_id, *filters])
+    async def add_events(self, events):
+        await self.send_many([
+            ["EVENT", event.to_json_object() if isinstance(event, Event) else event]
+            for event in events
+        ])
+
+    async def subscribe(self, sub_id: str, *filters, queue=None, seen: RecentIds=None, frame: str=None, raw: bool=False):
+        """
+        Subscribe to the filters. The returned queue receives Events, followed by None at EOSE.
+        With raw=True, it receives each event's json as bytes instead, leaving
+        parsing to the consumer.
+        Events whose ids are already in `seen` are skipped. Built Events are added to it,
+        but raw events are not: the consumer adds them once they have parsed.
+        `frame` is the already serialized REQ, if the caller has one
+        """
+        frame = frame or req_frame(sub_id, filters)
+        # kept on the subscription, so reconnect can resend it as is
+        self.subscriptions[sub_id] = Subscription(
+            filters=filters, queue=queue or asyncio.Queue(maxsize=self.queue_size),
+            seen=seen, req=frame, raw=raw, owns_queue=queue is None,
+        )
+        await self.send_raw(frame)
         return self.subscriptions[sub_id].queue
 
     async def unsubscribe(self, sub_id):
-        await self.send(["CLOSE", sub_id])
-        del self.subscriptions[sub_id]
+        """
+        Close the subscription. A queue passed in to subscribe() is left as it is,
+        since it may be shared with other subscriptions
+        """
+        await self.send_raw(close_frame(sub_id))
+        sub = self.subscriptions.pop(sub_id)
+        if sub.owns_queue and sub.queue.maxsize:
+            # nobody is going to read this queue anymore. empty it, in case
+            # the receive loop is blocked on putting to it
+            _drain(sub.queue)
 
     async def authenticate(self, challenge:str):
         if not self.private_key:
             import warnings
             warnings.warn("private key required to authenticate")
             return
-        from .key import PrivateKey
-        if self.private_key.startswith('nsec'):
-            from .util import from_nip19
-            pk = from_nip19(self.private_key)['object']
-        else:
-            pk = PrivateKey(bytes.fromhex(self.private_key))
+        pk = self._auth_key
+        if pk is None:
+            if self.private_key.startswith('nsec'):
+                pk = from_nip19(self.private_key)['object']
+            else:
+                pk = PrivateKey(bytes.fromhex(self.private_key))
+            self._auth_key = pk
         auth_event = Event(
             kind=22242,
             pubkey=pk.public_key.hex(),
@@ -145,10 +381,18 @@ class Relay:
                 ['relay', self.url]
             ]
         )
-        auth_event.sign(pk.hex())
-        await self.send(["AUTH", auth_event.to_json_object()])
-        await asyncio.sleep(0.1)
-        return True
+        pk.sign_event(auth_event)
+        waiter = asyncio.get_running_loop().create_future()
+        self.auth_waiters[auth_event.id] = waiter
+        try:
+            await self.send(["AUTH", auth_event.to_json_object()])
+            response = await asyncio.wait_for(waiter, self.connect_timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("No response to AUTH from %s", self.url)
+            return False
+        finally:
+            self.auth_waiters.pop(auth_event.id, None)
+        return response[2]
 
     async def __aenter__(self):
         await self.connect()
@@ -161,11 +405,31 @@ class Relay:
 class Manager:
     """
     Manage a collection of relays
+
+    queue_size is passed on to the relays and also bounds the subscription queues
+    here. See Relay for the deadlock that bounded queues can cause
     """
-    def __init__(self, relays=None, verbose=False, origin='aionostr', private_key=None, log=None):
+    # private_key is a property, setting it on every relay
+    __slots__ = (
+        'log', 'relays', 'subscriptions', '_merged_queues', '_queue_pool',
+        'seen_size', 'queue_size', 'random_sub_ids', '_sub_prefix', '_sub_counter',
+        'connected', '_connectlock',
+    )
+
+    def __init__(self, relays=None, verbose=False, origin='aionostr', private_key=None, log=None, seen_size: int=65536, queue_size: int=0, random_sub_ids: bool=False):
         self.log = log or logging.getLogger(__name__)
-        self.relays = [Relay(r, origin=origin, private_key=private_key, log=log) for r in (relays or [])]
+        self.relays = [Relay(r, origin=origin, private_key=private_key, log=log, queue_size=queue_size) for r in (relays or [])]
         self.subscriptions = {}
+        self._merged_queues = {}
+        # merged queues of closed subscriptions, to reuse on the next subscribe
+        self._queue_pool = []
+        self.seen_size = seen_size
+        self.queue_size = queue_size
+        # subscription ids only need to be unique per connection.
+        # random_sub_ids hides the counter behind a prefix picked once per manager
+        self.random_sub_ids = random_sub_ids
+        self._sub_prefix = secrets.token_hex(4) if random_sub_ids else 's'
+        self._sub_counter = 0
         self.connected = False
         self._connectlock = asyncio.Lock()
 
@@ -181,31 +445,47 @@ class Manager:
     def add(self, url, **kwargs):
         self.relays.append(Relay(url, **kwargs))
 
-    async def monitor_queues(self, queues, output):
-        seen = set()
-        num = len(queues)
+    async def monitor_queues(self, merged, output, num_relays, seen):
+        """
+        Turn the raw event json that every relay puts on `merged` into Events on `output`,
+        dropping the ones already in `seen`. None is passed on once all relays have sent EOSE
+        """
         num_eose = 0
+        get = merged.get
+        put = output.put
+        from_json = Event.from_json
+        add = seen.add
         while True:
-            get_funcs = [queue.get() for queue in queues]
-            for func in asyncio.as_completed(get_funcs):
-                result = await func
-                if result:
-                    eid = result.id_bytes
-                    if eid not in seen:
-                        await output.put(result)
-                        seen.add(eid)
-                else:
-                    num_eose += 1
-                    if num_eose == num:
-                        await output.put(result)
+            result = await get()
+            if result:
+                # the relays skip what has already been delivered, but two copies
+                # can still be in flight at once
+                try:
+                    event = from_json(result)
+                    key = int(event.id[:16], 16)
+                except Exception:
+                    # one malformed event shouldn't end the subscription
+                    self.log.warning("dropping malformed event %r", result, exc_info=True)
+                    continue
+                if add(key):
+                    await put(event)
+            else:
+                num_eose += 1
+                if num_eose == num_relays:
+                    await put(result)
 
     async def broadcast(self, func, *args, **kwargs):
-        results = []
-        for relay in self.relays:
-            results.append(asyncio.create_task(getattr(relay, func)(*args, **kwargs)))
-
+        """
+        Call func on every relay concurrently, returning the results in relay order.
+        Exceptions are logged and returned rather than raised, so one broken relay
+        can't abort the others (or shutdown)
+        """
         self.log.debug("Waiting for %s", func)
-        return await asyncio.wait(results)
+        results = await asyncio.gather(*[getattr(relay, func)(*args, **kwargs) for relay in self.relays], return_exceptions=True)
+        for relay, result in zip(self.relays, results):
+            if isinstance(result, Exception):
+                self.log.warning("%s failed on %s: %r", func, relay.url, result)
+        return results
 
     async def connect(self):
         async with self._connectlock:
@@ -224,18 +504,35 @@ class Manager:
     async def add_event(self, event, check_response=False):
         return await self.broadcast('add_event', event, check_response=check_response)
 
+    async def add_events(self, events):
+        return await self.broadcast('add_events', events)
+
     async def subscribe(self, sub_id: str, *filters):
-        queues = []
-        for relay in self.relays:
-            queues.append(await relay.subscribe(sub_id, *filters))
-        queue = asyncio.Queue()
-        self.subscriptions[sub_id] = asyncio.create_task(self.monitor_queues(queues, queue))
+        # every relay puts straight onto the one queue, and shares the dedup window,
+        # so an event that has been delivered isn't queued again
+        merged = self._queue_pool.pop() if self._queue_pool else asyncio.Queue(maxsize=self.queue_size)
+        seen = RecentIds(self.seen_size)
+        frame = req_frame(sub_id, filters)
+        await asyncio.gather(*[relay.subscribe(sub_id, *filters, queue=merged, seen=seen, frame=frame, raw=True) for relay in self.relays])
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscriptions[sub_id] = asyncio.create_task(self.monitor_queues(merged, queue, len(self.relays), seen))
+        self._merged_queues[sub_id] = merged
         return queue
 
     async def unsubscribe(self, sub_id):
         await self.broadcast('unsubscribe', sub_id)
-        self.subscriptions[sub_id].cancel()
-        del self.subscriptions[sub_id]
+        monitor = self.subscriptions.pop(sub_id)
+        monitor.cancel()
+        merged = self._merged_queues.pop(sub_id)
+        # the relays leave the merged queue alone, since it was passed in to them.
+        # emptying it frees any relay blocked putting to it
+        _drain(merged)
+        # only the merged queue is pooled: nothing outside the manager holds it.
+        # wait for the monitor to stop, which also lets a relay that was blocked
+        # putting to it finish, and only reuse the queue if that left it empty
+        await asyncio.wait([monitor])
+        if merged.empty() and len(self._queue_pool) < 32:
+            self._queue_pool.append(merged)
 
     async def __aenter__(self):
         await self.connect()
@@ -244,18 +541,29 @@ class Manager:
     async def __aexit__(self, ex_type, ex, tb):
         await self.close()
 
+    def next_sub_id(self) -> str:
+        self._sub_counter += 1
+        return f"{self._sub_prefix}{self._sub_counter:x}"
+
     async def get_events(self, *filters, only_stored=True, single_event=False):
-        sub_id = secrets.token_hex(4)
+        sub_id = self.next_sub_id()
         queue = await self.subscribe(sub_id, *filters)
-        while True:
-            event = await queue.get()
-            if event is None:
-                if only_stored:
-                    break
-            else:
-                yield event
-                if single_event:
-                    break
-        await self.unsubscribe(sub_id)
-
-
+        subscribed = True
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    if only_stored:
+                        break
+                elif single_event:
+                    # stop the other relays now, instead of letting them stream until EOSE
+                    subscribed = False
+                    await self.unsubscribe(sub_id)
+                    yield event
+                    return
+                else:
+                    yield event
+        finally:
+            # also runs if the caller stops iterating early
+            if subscribed:
+                await self.unsubscribe(sub_id)
@@ -23,36 +23,39 @@ def from_nip19(nip19string: str):
         retval['object'] = bytes(data[:-1]).hex()
     elif hrp in ('nevent', 'nprofile', 'nrelay', 'naddr'):
         tlv = {0: [], 1: [], 2: [], 3: []}
-        while data:
-            t = data[0]
-            try:
-                l = data[1]
-            except IndexError:
-                break
-            v = data[2:2+l]
-            data = data[2+l:]
+        data = bytes(data)
+        # walk the entries with a cursor, rather than re-slicing the remaining data
+        offset = 0
+        end = len(data) - 1
+        while offset < end:
+            t = data[offset]
+            l = data[offset + 1]
+            v = data[offset + 2:offset + 2 + l]
+            offset += 2 + l
             if not v:
                 continue
             tlv[t].append(v)
         if tlv[0]:
             if hrp not in ('nrelay', 'naddr'):
-                key_or_id = bytes(tlv[0][0]).hex()
+                key_or_id = tlv[0][0].hex()
             else:
-                key_or_id = bytes(tlv[0][0]).decode()
+                key_or_id = tlv[0][0].decode()
         else:
             key_or_id = ''
-        relays = []
-        for relay in tlv[1]:
-            relays.append(bytes(relay).decode('utf8'))
+        relays = [relay.decode('utf8') for relay in tlv[1]]
         if tlv[2]:
-            retval['author'] = bytes(tlv[2][0]).hex()
+            retval['author'] = tlv[2][0].hex()
         if tlv[3]:
-            retval['kind'] = int.from_bytes(bytes(tlv[3][0]), 'big')
+            retval['kind'] = int.from_bytes(tlv[3][0], 'big')
         retval['object'] = key_or_id
         retval['relays'] = relays
     return retval
 
 
+def _tlv(t: int, value: bytes) -> bytes:
+    return bytes((t, len(value))) + value
+
+
 def to_nip19(ntype: str, payload: str, relays=None, author=None, kind=None):
     """
     Encode object as nip-19 compatible string
@@ -60,39 +63,19 @@ def to_nip19(ntype: str, payload: str, relays=None, author=None, kind=None):
     if ntype in ('npub', 'nsec', 'note'):
         data = bytes.fromhex(payload)
     elif ntype in ('nprofile', 'nevent', 'nrelay', 'naddr'):
-        data = bytearray()
-        if ntype == 'nrelay':
-            encoded = payload.encode()
-            data.append(0)
-            data.append(len(encoded))
-            data.extend(encoded)
-        elif ntype == 'naddr':
-            encoded = payload.encode()
-            data.append(0)
-            data.append(len(encoded))
-            data.extend(encoded)
+        if ntype in ('nrelay', 'naddr'):
+            parts = [_tlv(0, payload.encode())]
+        else:
+            # payload is event id or public key
+            parts = [_tlv(0, bytes.fromhex(payload))]
+        if ntype == 'naddr':
             if author:
-                author_encoded = bytes.fromhex(author)
-                data.append(2)
-                data.append(len(author_encoded))
-                data.extend(author_encoded)
+                parts.append(_tlv(2, bytes.fromhex(author)))
             if kind:
-                kind_bytes = kind.to_bytes(4, 'big')
-                data.append(3)
-                data.append(len(kind_bytes))
-                data.extend(kind_bytes)
-        else:
-            # payload is event id
-            event_id = bytes.fromhex(payload)
-            data.append(0)
-            data.append(len(event_id))
-            data.extend(event_id)
+                parts.append(_tlv(3, kind.to_bytes(4, 'big')))
         if relays:
-            for r in relays:
-                r = r.encode()
-                data.append(1)
-                data.append(len(r))
-                data.extend(r)
+            parts.extend(_tlv(1, r.encode()) for r in relays)
+        data = b''.join(parts)
     else:
         data = payload.encode()
     converted_bits = bech32.convertbits(data, 8, 5)
@@ -12,12 +12,17 @@ with open("HISTORY.rst") as history_file:
 
 requirements = [
     "Click>=7.0",
-    "websockets",
+    # 14.0 made the asyncio client, with recv(decode=False), the default
+    "websockets>=14.0",
     "cryptography>=37.0.4",
     "pycparser>=2.21",
     "coincurve>=20.0",
 ]
 
+extra_requirements = {
+    "fast": ["orjson>=3.10", "uvloop"],
+}
+
 test_requirements = [
     "pytest>=3",
 ]
@@ -25,14 +30,13 @@ test_requirements = [
 setup(
     author="Dave St.Germain",
     author_email="dave@st.germa.in",
-    python_requires=">=3.8",
+    python_requires=">=3.9",
     classifiers=[
         "Development Status :: 2 - Pre-Alpha",
         "Intended Audience :: Developers",
         "License :: OSI Approved :: BSD License",
         "Natural Language :: English",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
         "Programming Language :: Python :: 3.11",
@@ -45,6 +49,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="BSD license",
     long_description=readme + "\n\n" + history,
     include_package_data=True,
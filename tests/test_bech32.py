@@ -0,0 +1,83 @@
+"""Tests for `aionostr.bech32` and the nip-19 encoding built on it."""
+
+import random
+
+import pytest
+
+from aionostr import bech32
+from aionostr.util import from_nip19, to_nip19
+
+
+def reference_convertbits(data, frombits, tobits, pad=True):
+    """The generic bip-173 loop, which the 8 <-> 5 fast paths replace."""
+    acc = 0
+    bits = 0
+    ret = []
+    maxv = (1 << tobits) - 1
+    max_acc = (1 << (frombits + tobits - 1)) - 1
+    for value in data:
+        if value < 0 or (value >> frombits):
+            return None
+        acc = ((acc << frombits) | value) & max_acc
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            ret.append((acc >> bits) & maxv)
+    if pad:
+        if bits:
+            ret.append((acc << (tobits - bits)) & maxv)
+    elif bits >= frombits or ((acc << (tobits - bits)) & maxv):
+        return None
+    return ret
+
+
+@pytest.mark.parametrize("length", list(range(70)) + [300])
+def test_convertbits_matches_reference(length):
+    rng = random.Random(length)
+    for _ in range(20):
+        data = bytes(rng.randrange(256) for _ in range(length))
+        assert bech32.convertbits(data, 8, 5) == reference_convertbits(data, 8, 5)
+        assert bech32.convertbits(list(data), 8, 5) == reference_convertbits(data, 8, 5)
+        values = [rng.randrange(32) for _ in range(length)]
+        assert bech32.convertbits(values, 5, 8) == reference_convertbits(values, 5, 8)
+
+
+@pytest.mark.parametrize("data, frombits, tobits", [
+    ([256, 1], 8, 5),
+    ([-1], 8, 5),
+    ([32, 1, 2], 5, 8),
+    ([1, -1], 5, 8),
+    # what bech32_decode returns for an invalid string
+    (None, 8, 5),
+    (None, 5, 8),
+])
+def test_convertbits_out_of_range(data, frombits, tobits):
+    if data is None:
+        with pytest.raises(TypeError):
+            reference_convertbits(data, frombits, tobits)
+        with pytest.raises(TypeError):
+            bech32.convertbits(data, frombits, tobits)
+    else:
+        assert bech32.convertbits(data, frombits, tobits) is None
+        assert reference_convertbits(data, frombits, tobits) is None
+
+
+# vectors from nip-19
+NPUB = "npub10elfcs4fr0l0r8af98jlmgdh9c8tcxjvz9qkw038js35mp4dma8qzvjptg"
+NPUB_HEX = "7e7e9c42a91bfef19fa929e5fda1b72e0ebc1a4c1141673e2794234d86addf4e"
+NSEC = "nsec1vl029mgpspedva04g90vltkh6fvh240zqtv9k0t9af8935ke9laqsnlfe5"
+NSEC_HEX = "67dea2ed018072d675f5415ecfaed7d2597555e202d85b3d65ea4e58d2d92ffa"
+NPROFILE = (
+    "nprofile1qqsrhuxx8l9ex335q7he0f09aej04zpazpl0ne2cgukyawd24mayt8gpp4mhxue69uhhytnc9e3k7mgpz4mhxue69uhkg6nzv9ejuumpv34kytnrdaksjlyr9p"
+)
+
+
+def test_nip19_vectors():
+    assert to_nip19("npub", NPUB_HEX) == NPUB
+    assert to_nip19("nsec", NSEC_HEX) == NSEC
+    assert from_nip19(NPUB)["object"].hex() == NPUB_HEX
+    assert from_nip19(NSEC)["object"].hex() == NSEC_HEX
+    profile = from_nip19(NPROFILE)
+    assert profile["object"] == "3bf0c63fcb93463407af97a5e5ee64fa883d107ef9e558472c4eb9aaaefa459d"
+    assert profile["relays"] == ["wss://r.x.com", "wss://djbas.sadkb.com"]
+    assert to_nip19("nprofile", profile["object"], relays=profile["relays"]) == NPROFILE
@@ -0,0 +1,71 @@
+"""Tests for NIP-04 encryption in `aionostr.key`."""
+
+import binascii
+import copy
+import pickle
+
+import pytest
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from aionostr.key import PrivateKey
+
+
+ALICE = PrivateKey(bytes.fromhex("11" * 32))
+BOB = PrivateKey(bytes.fromhex("22" * 32))
+
+# made with cryptography's own ECDH and PKCS7 padder, from ALICE to BOB, with iv 00..0f
+KNOWN_MESSAGE = "nostr: héllo ✓"
+KNOWN_CIPHERTEXT = "t74Ywqi4R8Z8Q+Y5xMhuAS1xBE+/X86l6vsNk5EGXZY=?iv=AAECAwQFBgcICQoLDA0ODw=="
+
+
+def test_shared_secret_is_symmetric():
+    assert ALICE.compute_shared_secret(BOB.public_key.hex()) == BOB.compute_shared_secret(
+        ALICE.public_key.hex()
+    )
+
+
+@pytest.mark.parametrize("length", [0, 1, 15, 16, 17, 32, 100])
+def test_round_trip(length):
+    message = "x" * length
+    encrypted = ALICE.encrypt_message(message, BOB.public_key.hex())
+    content, iv = encrypted.split("?iv=")
+    # always padded, to whole blocks
+    assert len(binascii.a2b_base64(content)) == (length // 16 + 1) * 16
+    assert len(binascii.a2b_base64(iv)) == 16
+    assert BOB.decrypt_message(encrypted, ALICE.public_key.hex()) == message
+
+
+def test_decrypt_known_ciphertext():
+    assert BOB.decrypt_message(KNOWN_CIPHERTEXT, ALICE.public_key.hex()) == KNOWN_MESSAGE
+    assert ALICE.decrypt_message(KNOWN_CIPHERTEXT, BOB.public_key.hex()) == KNOWN_MESSAGE
+
+
+def _encrypt_raw(plaintext: bytes, iv: bytes) -> str:
+    """Encrypt already padded (or deliberately mis-padded) bytes, from ALICE to BOB"""
+    secret = ALICE.compute_shared_secret(BOB.public_key.hex())
+    encryptor = Cipher(algorithms.AES(secret), modes.CBC(iv)).encryptor()
+    encrypted = encryptor.update(plaintext) + encryptor.finalize()
+    return f"{binascii.b2a_base64(encrypted, newline=False).decode()}?iv={binascii.b2a_base64(iv, newline=False).decode()}"
+
+
+@pytest.mark.parametrize("plaintext", [
+    b"hello" + bytes([0]) * 11,
+    b"hello" + bytes([17]) * 11,
+    b"hello" + bytes([3]) * 10 + bytes([4]),
+    b"",
+])
+def test_bad_padding(plaintext):
+    with pytest.raises(ValueError):
+        BOB.decrypt_message(_encrypt_raw(plaintext, bytes(16)), ALICE.public_key.hex())
+
+
+def pickle_round_trip(obj):
+    return pickle.loads(pickle.dumps(obj))
+
+
+@pytest.mark.parametrize("clone", [pickle_round_trip, copy.deepcopy, copy.copy])
+def test_private_key_copies(clone):
+    key = clone(ALICE)
+    assert key == ALICE
+    assert key.public_key.hex() == ALICE.public_key.hex()
+    assert key.compute_shared_secret(BOB.public_key.hex()) == ALICE.compute_shared_secret(BOB.public_key.hex())
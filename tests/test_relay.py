@@ -0,0 +1,375 @@
+"""Tests for the frame helpers and dedup in `aionostr.relay`."""
+
+import asyncio
+import json
+
+import pytest
+
+from aionostr import relay as relay_module
+from aionostr.event import Event
+from aionostr.key import PrivateKey
+from aionostr.relay import Manager, RecentIds, Relay, close_frame, req_frame, split_event
+
+
+# content comes first, so its (escaped) lookalike of the id key is seen before the real one
+EVENT = {
+    "content": 'quoted "id":"' + "0" * 64 + '" inside content',
+    "id": "ab" * 32,
+    "pubkey": "cd" * 32,
+    "created_at": 1700000000,
+    "kind": 1,
+    "tags": [["p", "ef" * 32]],
+    "sig": "12" * 64,
+}
+
+
+def compact(obj):
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def test_split_event_compact():
+    """Compact frames are split without parsing the event."""
+    sub_id, event_id, event = split_event(compact(["EVENT", "s1", EVENT]))
+    assert sub_id == "s1"
+    assert event_id == EVENT["id"].encode()
+    assert event == compact(EVENT)
+
+
+def test_split_event_spaced():
+    """Frames with whitespace are parsed in full."""
+    frame = json.dumps(["EVENT", "s1", EVENT]).encode()
+    sub_id, event_id, event = split_event(frame)
+    assert sub_id == "s1"
+    assert event_id == EVENT["id"].encode()
+    assert event == EVENT
+
+
+def test_split_event_escaped_sub_id():
+    """A sub_id containing escapes is decoded properly."""
+    frame = compact(["EVENT", 'a"b\\c', EVENT])
+    sub_id, event_id, event = split_event(frame)
+    assert sub_id == 'a"b\\c'
+    assert event_id == EVENT["id"].encode()
+    assert event == EVENT
+
+
+def test_split_event_short_id():
+    """An id that isn't 64 characters falls back to the full parse."""
+    short = dict(EVENT, id="abcd")
+    sub_id, event_id, event = split_event(compact(["EVENT", "s1", short]))
+    assert sub_id == "s1"
+    assert event_id == b"abcd"
+    assert event == short
+
+
+def test_split_event_missing_id():
+    """An event without an id can't be split."""
+    missing = {k: v for k, v in EVENT.items() if k != "id"}
+    with pytest.raises(KeyError):
+        split_event(compact(["EVENT", "s1", missing]))
+
+
+def test_recent_ids_rotation():
+    """Ids are remembered for between size and 2 * size additions."""
+    seen = RecentIds(2)
+    assert seen.add(1)
+    assert not seen.add(1)
+    assert seen.add(2)
+    # 1 and 2 are now the old generation
+    assert not seen.add(1)
+    assert seen.add(3)
+    assert seen.add(4)
+    # rotated again: 1 and 2 are forgotten, 3 and 4 are still known
+    assert seen.add(1)
+    assert not seen.add(3)
+    assert not seen.add(4)
+
+
+@pytest.mark.parametrize("sub_id", ["s1", "a b", 'quo"te', "back\\slash", "ünï"])
+def test_req_and_close_frames(sub_id):
+    """Frames are valid json, whatever the sub_id."""
+    filters = [{"kinds": [1], "limit": 10}, {"authors": ["ab" * 32]}]
+    assert json.loads(req_frame(sub_id, filters)) == ["REQ", sub_id, *filters]
+    assert json.loads(close_frame(sub_id)) == ["CLOSE", sub_id]
+
+
+def test_req_frame_alphanumeric_sub_id():
+    """Plain sub_ids are used without going through dumps."""
+    assert req_frame("s1", [{}]) == '["REQ","s1",{}]'
+    assert close_frame("s1") == '["CLOSE","s1"]'
+
+
+@pytest.mark.parametrize("data", [compact(EVENT), compact(EVENT).decode()])
+def test_event_from_json(data):
+    """Events can be built from json bytes or str."""
+    event = Event.from_json(data)
+    assert event.id == EVENT["id"]
+    assert event.content == EVENT["content"]
+    assert event.tags == EVENT["tags"]
+    assert event.to_json_object() == EVENT
+
+
+# Relay and Manager, driven end to end through fake websockets
+
+
+def make_event(n, **extra):
+    # the dedup key is the start of the id, so vary that
+    event = dict(EVENT, id=f"{n:02x}" * 32, content=f"c{n}")
+    event.update(extra)
+    return event
+
+
+class FakeSocket:
+    """A websocket connection to a fake relay: replies are scripted by FakeRelays.respond"""
+
+    def __init__(self, relays, url):
+        self.relays = relays
+        self.url = url
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    def feed(self, *messages):
+        for message in messages:
+            self.incoming.put_nowait(message if isinstance(message, bytes) else compact(message))
+
+    async def recv(self, decode=None):
+        return await self.incoming.get()
+
+    async def send(self, frame):
+        message = json.loads(frame)
+        self.sent.append(message)
+        self.feed(*self.relays.respond(self.url, message))
+
+    async def close(self):
+        pass
+
+
+class FakeRelays:
+    def __init__(self):
+        self.sockets = {}
+        # (url, message sent by the client) -> messages the relay sends back
+        self.respond = lambda url, message: []
+
+    async def connect(self, url, **kwargs):
+        self.sockets[url] = FakeSocket(self, url)
+        return self.sockets[url]
+
+
+@pytest.fixture
+def relays(monkeypatch):
+    fake = FakeRelays()
+    monkeypatch.setattr(relay_module, "connect", fake.connect)
+    return fake
+
+
+def stored(events_by_url):
+    """Answer each REQ with the relay's events, then EOSE"""
+    def respond(url, message):
+        if message[0] != "REQ":
+            return []
+        return [["EVENT", message[1], event] for event in events_by_url.get(url, [])] + [["EOSE", message[1]]]
+    return respond
+
+
+async def collect(manager, *filters, **kwargs):
+    return [event async for event in manager.get_events(*filters, **kwargs)]
+
+
+def test_manager_merges_and_dedups(relays):
+    """Events from every relay come out once each, and the stream ends at the last EOSE."""
+    relays.respond = stored({
+        "wss://a": [make_event(1), make_event(2)],
+        "wss://b": [make_event(2), make_event(3), make_event(1)],
+    })
+
+    async def main():
+        async with Manager(["wss://a", "wss://b"]) as manager:
+            return await collect(manager, {"kinds": [1]})
+
+    events = asyncio.run(main())
+    assert sorted(event.content for event in events) == ["c1", "c2", "c3"]
+    assert all(isinstance(event, Event) for event in events)
+
+
+def test_manager_waits_for_every_eose(relays):
+    """A relay that is slow to answer still gets its events in before the stream ends."""
+    relays.respond = stored({"wss://a": [make_event(1)]})
+    slow = "wss://b"
+    respond = relays.respond
+    relays.respond = lambda url, message: [] if url == slow else respond(url, message)
+
+    async def main():
+        async with Manager(["wss://a", slow]) as manager:
+            task = asyncio.create_task(collect(manager, {}))
+            await asyncio.sleep(0.01)
+            assert not task.done()
+            sub_id = relays.sockets[slow].sent[-1][1]
+            relays.sockets[slow].feed(["EVENT", sub_id, make_event(2)], ["EOSE", sub_id])
+            return await asyncio.wait_for(task, 1)
+
+    events = asyncio.run(main())
+    assert sorted(event.content for event in events) == ["c1", "c2"]
+
+
+def test_manager_parses_non_compact_frames(relays):
+    """Pretty-printed EVENT frames are delivered too."""
+    def respond(url, message):
+        if message[0] != "REQ":
+            return []
+        return [json.dumps(["EVENT", message[1], make_event(1)], indent=1).encode(), ["EOSE", message[1]]]
+    relays.respond = respond
+
+    async def main():
+        async with Manager(["wss://a"]) as manager:
+            return await collect(manager, {})
+
+    assert [event.content for event in asyncio.run(main())] == ["c1"]
+
+
+def test_single_event_unsubscribes_early(relays):
+    """single_event closes the subscription on every relay after the first event."""
+    relays.respond = stored({
+        "wss://a": [make_event(1), make_event(2)],
+        "wss://b": [make_event(3)],
+    })
+
+    async def main():
+        async with Manager(["wss://a", "wss://b"]) as manager:
+            events = await collect(manager, {}, single_event=True)
+            assert manager.subscriptions == {}
+            return events
+
+    events = asyncio.run(main())
+    assert len(events) == 1
+    for socket in relays.sockets.values():
+        req, close = socket.sent
+        assert req[0] == "REQ"
+        assert close == ["CLOSE", req[1]]
+
+
+def test_merged_queue_is_reused(relays):
+    """A closed subscription's merged queue goes back to the pool for the next one."""
+    relays.respond = stored({"wss://a": [make_event(1)]})
+
+    async def main():
+        async with Manager(["wss://a"]) as manager:
+            await collect(manager, {})
+            assert len(manager._queue_pool) == 1
+            pooled = manager._queue_pool[0]
+            await manager.subscribe("again", {})
+            assert manager._merged_queues["again"] is pooled
+            assert manager._queue_pool == []
+            await manager.unsubscribe("again")
+
+    asyncio.run(main())
+
+
+def test_auth_ok_goes_to_its_waiter(relays):
+    """The OK for an AUTH resolves authenticate; other OKs still reach add_event."""
+    key = PrivateKey(bytes.fromhex("11" * 32))
+
+    def respond(url, message):
+        if message[0] == "AUTH":
+            return [["OK", message[1]["id"], True, ""]]
+        if message[0] == "EVENT":
+            return [["OK", message[1]["id"], True, "saved"]]
+        return []
+    relays.respond = respond
+
+    async def main():
+        relay = Relay("wss://a", private_key=key.hex())
+        await relay.connect()
+        relays.sockets["wss://a"].feed(["AUTH", "challenge-1"])
+        while relay.auth_task is None:
+            await asyncio.sleep(0)
+        assert await asyncio.wait_for(relay.auth_task, 1) is True
+        assert relay.event_adds.empty()
+        assert relay.auth_waiters == {}
+
+        auth = relays.sockets["wss://a"].sent[0][1]
+        event = Event(**auth)
+        assert event.verify()
+        assert event.pubkey == key.public_key.hex()
+        assert ["challenge", "challenge-1"] in event.tags
+
+        # add_event hands back the OK for that event
+        assert await relay.add_event(make_event(5), check_response=True) == make_event(5)["id"]
+        await relay.close()
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("bad_copy", [
+    lambda sub_id, event: ["EVENT", sub_id, dict(event, seen_on=["wss://x"])],
+    lambda sub_id, event: ["EVENT", sub_id, dict(event, content=5)],
+    lambda sub_id, event: compact(["EVENT", sub_id, event])[:-2] + b",}]",
+])
+def test_bad_copy_does_not_hide_good_copy(relays, bad_copy):
+    """A copy of an event that won't parse doesn't stop another relay's copy."""
+    event = make_event(7)
+
+    def respond(url, message):
+        if message[0] != "REQ":
+            return []
+        copy = bad_copy(message[1], event) if url == "wss://a" else ["EVENT", message[1], event]
+        return [copy, ["EOSE", message[1]]]
+    relays.respond = respond
+
+    async def main():
+        async with Manager(["wss://a", "wss://b"]) as manager:
+            return await collect(manager, {})
+
+    assert [event.content for event in asyncio.run(main())] == ["c7"]
+
+
+def test_unsubscribe_keeps_shared_queue(relays):
+    """Closing one subscription doesn't throw away another's items on a shared queue."""
+    relays.respond = stored({"wss://a": [make_event(1)]})
+
+    async def main():
+        relay = Relay("wss://a")
+        await relay.connect()
+        shared = asyncio.Queue()
+        await relay.subscribe("one", {}, queue=shared)
+        await relay.subscribe("two", {}, queue=shared)
+        while shared.qsize() < 4:
+            await asyncio.sleep(0)
+        await relay.unsubscribe("one")
+        assert shared.qsize() == 4
+        await relay.close()
+
+    asyncio.run(main())
+
+
+def test_unsubscribe_frees_blocked_receive_loop(relays):
+    """Closing a subscription whose bounded queue is full lets other replies through."""
+    relays.respond = stored({"wss://a": [make_event(n) for n in range(1, 4)]})
+
+    async def main():
+        relay = Relay("wss://a", queue_size=1)
+        await relay.connect()
+        await relay.subscribe("full", {})
+        relays.sockets["wss://a"].feed(["NOTICE", "after the events"])
+        await asyncio.sleep(0.01)
+        # the receive loop is stuck behind the full queue
+        assert relay.notices.empty()
+        await relay.unsubscribe("full")
+        assert await asyncio.wait_for(relay.notices.get(), 1) == "after the events"
+        await relay.close()
+
+    asyncio.run(main())
+
+
+def test_manager_unsubscribe_frees_bounded_relays(relays):
+    """With bounded queues, an abandoned subscription doesn't wedge the relay."""
+    relays.respond = stored({"wss://a": [make_event(n) for n in range(1, 6)]})
+
+    async def main():
+        async with Manager(["wss://a"], queue_size=1) as manager:
+            first = await asyncio.wait_for(collect(manager, {}, single_event=True), 1)
+            rest = await asyncio.wait_for(collect(manager, {}), 1)
+            return first, rest
+
+    first, rest = asyncio.run(main())
+    assert len(first) == 1
+    assert sorted(event.content for event in rest) == [f"c{n}" for n in range(1, 6)]